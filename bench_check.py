@@ -0,0 +1,143 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import shapely
+
+# Benchmark for the /check hot paths: for every focus level and a few
+# representative places it builds the same grid /check would (grid_axes, the
+# water lookup, encode_runs) and reports points/sec, p50/p99 latency and peak
+# memory. Results are saved as JSON; --baseline prints the speedup against an
+# earlier run.
+#
+# It loads the real world map (10m-world-map-rounded-to-3.json) and the rasters
+# from the current directory, so run it from the directory the server runs in. Peak
+# memory is what tracemalloc sees (Python and numpy allocations, not GEOS), in a
+# separate untimed pass.
+
+from grid_encoding import encode_runs
+from watermap import (
+    FOCUS_STEP_MAP, grid_axes, load_water_polygons, raster_block, raster_origin, water_grid, water_rasters,
+)
+
+LOCATIONS = {
+    "ocean/south-pacific": (-30.0, -140.0),
+    "ocean/mid-atlantic": (25.0, -40.0),
+    "coast/san-francisco": (37.8, -122.5),
+    "coast/norway": (61.0, 5.0),
+    "archipelago/visayas": (10.5, 123.5),
+    "archipelago/aegean": (37.5, 25.0),
+    "inland/kansas": (39.0, -98.0),
+    "inland/mongolia": (46.5, 103.0),
+}
+
+
+def check_grid(lookup, focus_level, lat, lon, radius_miles):
+    # The grid /check builds for this request, as a function returning the bool
+    # array (lookup "raster" needs water_raster/level<N>.bin)
+    step = FOCUS_STEP_MAP[focus_level]
+    lat_range = lon_range = int(radius_miles / 69.0 / step)
+    if lookup == "raster":
+        row, col = raster_origin(focus_level, lat, lon)
+        return lambda: raster_block(focus_level, row - lat_range, col - lon_range, 2 * lat_range + 1, 2 * lon_range + 1)
+    lats, lons = grid_axes(lat, lon, step, lat_range, lon_range)
+    return lambda: water_grid(lats, lons)
+
+
+def run_case(grid, repeats):
+    grid()  # warm up (tree queries, page cache for the raster)
+    grid_times = []
+    encode_times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        water = grid()
+        classified = time.perf_counter()
+        encode_runs(water)
+        grid_times.append(classified - started)
+        encode_times.append(time.perf_counter() - classified)
+
+    tracemalloc.start()
+    encode_runs(grid())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    totals = np.add(grid_times, encode_times)
+    points = int(water.size)
+    return {
+        "points": points,
+        "water_fraction": round(float(water.mean()), 4),
+        "p50_ms": round(float(np.percentile(totals, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(totals, 99)) * 1000, 3),
+        "grid_p50_ms": round(float(np.percentile(grid_times, 50)) * 1000, 3),
+        "encode_p50_ms": round(float(np.percentile(encode_times, 50)) * 1000, 3),
+        "points_per_sec": round(points / float(np.percentile(totals, 50))),
+        "peak_mb": round(peak / 2**20, 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case["case"]: case for case in json.load(f)["cases"]}
+    print(f"\nagainst {baseline_path} (p50 speedup, >1 is faster now)")
+    for case in results:
+        old = baseline.get(case["case"])
+        if old:
+            print(f"{case['case']:>48}: {old['p50_ms'] / case['p50_ms']:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /check grids across focus levels and places.")
+    parser.add_argument("--levels", type=int, nargs="+", default=sorted(FOCUS_STEP_MAP),
+                        help="focus levels to run (default: all)")
+    parser.add_argument("--lookups", nargs="+", default=["polygons", "raster"], choices=["polygons", "raster"],
+                        help="water lookups to run; raster levels without a raster file are skipped")
+    parser.add_argument("--radius", type=float, default=20, help="radius in miles (default: 20)")
+    parser.add_argument("--repeats", type=int, default=20, help="timed runs per case (default: 20)")
+    parser.add_argument("--out", help="JSON results file (default: bench_check-<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    load_water_polygons()
+    results = []
+    for lookup in args.lookups:
+        for level in args.levels:
+            if lookup == "raster" and level not in water_rasters:
+                print(f"skipping raster level {level}: no raster built")
+                continue
+            for place, (lat, lon) in LOCATIONS.items():
+                name = f"{lookup}/level{level}/{place}"
+                case = run_case(check_grid(lookup, level, lat, lon, args.radius), args.repeats)
+                case.update(case=name, lookup=lookup, focus_level=level, lat=lat, lon=lon)
+                results.append(case)
+                print(f"{name:>48}: {case['points']:>7} pts  {case['points_per_sec']:>11,} pts/s  "
+                      f"p50 {case['p50_ms']:8.2f} ms  p99 {case['p99_ms']:8.2f} ms  peak {case['peak_mb']:6.1f} MB")
+
+    out_path = args.out or time.strftime("bench_check-%Y%m%d-%H%M%S.json")
+    with open(out_path, "w") as f:
+        json.dump({
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "shapely": shapely.__version__,
+            "geos": shapely.geos_version_string,
+            "radius_miles": args.radius,
+            "repeats": args.repeats,
+            "cases": results,
+        }, f, indent=1)
+    print(f"wrote {out_path}")
+
+    if args.baseline:
+        print_comparison(results, args.baseline)
@@ -0,0 +1,82 @@
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+# Memory benchmark for the strike table: builds N tracked addresses (IPv4 and
+# IPv6 strings, the same keys get_client_ip hands out) with StrikeRecord values
+# and with the plain dicts the table used to hold, and reports bytes per IP.
+# Only the record values differ between the two, so the gap is what the slotted
+# record saves. The "table" figures are the table dict plus its values; the IP
+# strings are shared by both and reported on their own.
+
+from strike_records import StrikeRecord
+
+
+def random_ip(rng):
+    if rng.random() < 0.8:
+        return ".".join(str(rng.randrange(256)) for _ in range(4))
+    return ":".join(f"{rng.randrange(0x10000):x}" for _ in range(8))
+
+
+def make_ips(count, seed):
+    rng = random.Random(seed)
+    ips = set()
+    while len(ips) < count:
+        ips.add(random_ip(rng))
+    return list(ips)
+
+
+def record_values(count, seed):
+    rng = random.Random(seed)
+    now = time.time()
+    for _ in range(count):
+        yield rng.uniform(0, 300), now - rng.uniform(0, 86400), now + rng.uniform(-3600, 3600)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    table = build()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return table, current, peak, elapsed
+
+
+def report(name, count, current, peak, elapsed):
+    print(f"{name:>18}: {current / count:7.1f} B/IP  "
+          f"({current / 2**20:7.1f} MB, peak {peak / 2**20:7.1f} MB, {elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-IP memory footprint of the strike table.")
+    parser.add_argument("--ips", type=int, default=1_000_000, help="tracked addresses (default: 1M)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    ips = make_ips(args.ips, args.seed)
+    print(f"{args.ips} addresses")
+
+    # Fresh copies of the IP strings, shared by both tables below
+    keys, key_bytes, key_peak, key_elapsed = measure(lambda: [ip.encode().decode() for ip in ips])
+    report("ip strings", args.ips, key_bytes, key_peak, key_elapsed)
+
+    def build_dicts():
+        return {ip: {"strikes": s, "last_update": u, "cooldown_until": c}
+                for ip, (s, u, c) in zip(keys, record_values(args.ips, args.seed))}
+
+    def build_records():
+        return {ip: StrikeRecord(s, u, c) for ip, (s, u, c) in zip(keys, record_values(args.ips, args.seed))}
+
+    results = {}
+    for name, build in (("dict records", build_dicts), ("StrikeRecord", build_records)):
+        table, current, peak, elapsed = measure(build)
+        results[name] = current
+        report(name + " table", args.ips, current, peak, elapsed)
+        del table
+
+    saved = results["dict records"] - results["StrikeRecord"]
+    print(f"StrikeRecord saves {saved / args.ips:.1f} B/IP ({saved / 2**20:.1f} MB at {args.ips} IPs)")
@@ -1,21 +1,34 @@
 import random
-from flask import Flask, request, jsonify, render_template, abort, redirect, url_for, make_response, flash
-from shapely.geometry import shape, Point
+from flask import Flask, request, jsonify, render_template, abort, redirect, url_for, make_response, flash, Response, stream_with_context
+import numpy as np
 from datetime import datetime, timedelta
 import json
-import math
 import time
 import os
+import threading
+import sqlite3
+import atexit
+import signal
+import fcntl
+import bisect
+import heapq
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from watermap import (
+    FOCUS_STEP_MAP, fit_radius, grid_axes, load_water_polygons, raster_block, raster_origin, water_grid, water_rasters,
+)
+from grid_encoding import encode_binary, encode_runs, stream_runs
+from strike_records import StrikeRecord, StrikeTable
 
 print("Env PORT =", os.environ.get("PORT"))
 
 app = Flask(__name__)
 app.secret_key = "some-super-secret-key-that-no-one-else-knows"
 
-# Load simplified GeoJSON coastline map (water polygons)
-with open("10m-world-map-rounded-to-3.json", "r") as f:
-    geojson_data = json.load(f)
-    water_shapes = [shape(geom) for geom in geojson_data["geometries"]]
+# WATER_LOOKUP=raster makes /check answer from the precomputed rasters (see
+# watermap.py) by default; a request can also pick with lookup=raster /
+# lookup=polygons.
+WATER_LOOKUP = os.environ.get("WATER_LOOKUP", "polygons")
 
 # Load whitelist IPs
 with open("whitelist.json") as f:
@@ -25,13 +38,346 @@ with open("whitelist.json") as f:
 with open("passwords.json") as f:
     ADMIN_PASSWORDS = json.load(f)
 
-# Load or initialize bannage data
+# Strike state lives in memory (ip_strikes) and every change is written through
+# to a store. STRIKE_STORE picks the backend:
+#   journal (default): bannage.json snapshot plus an append-only journal, locked by
+#       a single process
+#   sqlite: one row per IP in a WAL-mode SQLite database, indexed on cooldown_until.
+#       Shared by every worker process: rows are re-read before use and changed
+#       inside write transactions, so several gunicorn workers can run at once.
 BANNAGE_FILE = "bannage.json"
-if os.path.exists(BANNAGE_FILE):
-    with open(BANNAGE_FILE, "r") as f:
-        ip_strikes = json.load(f)
+BANNAGE_JOURNAL = "bannage.journal"
+JOURNAL_COMPACT_EVERY = 5000
+STRIKE_STORE = os.environ.get("STRIKE_STORE", "journal")
+STRIKE_DB = os.environ.get("STRIKE_DB", "bannage.sqlite3")
+
+# Locking for threaded serving. A record is only read-modify-written under its
+# IP's stripe lock (see strike_record), and anything that adds or removes IPs or
+# walks the whole table holds strike_table_lock, so a walk never sees the dict
+# change size under it. Take a stripe lock before the table lock, never after.
+STRIKE_LOCK_STRIPES = 64
+strike_locks = [threading.RLock() for _ in range(STRIKE_LOCK_STRIPES)]
+strike_table_lock = threading.RLock()
+
+def load_bannage_snapshot():
+    if os.path.exists(BANNAGE_FILE):
+        with open(BANNAGE_FILE, "r") as f:
+            return StrikeTable((ip, StrikeRecord.from_json(data)) for ip, data in json.load(f).items())
+    return StrikeTable()
+
+class JournalStrikeStore:
+    # bannage.json is a snapshot, and every change since then is a line in the
+    # journal ({"ip": ..., "data": record or null when the IP was removed}),
+    # replayed on top of it in order
+    shared = False
+
+    def __init__(self, snapshot_file, journal_path):
+        self.snapshot_file = snapshot_file
+        self.journal_path = journal_path
+        self.entries = 0
+        self.records = StrikeTable()
+        self.challenges = {}
+        self.lock = threading.RLock()
+        self.banned = {}  # ip -> cooldown_until of every active ban
+        self.bans = []  # heap of (cooldown_until, ip), for expiring them
+        self.ban_lock = threading.Lock()
+
+    def load(self):
+        # Only one process may own the journal: a second writer would interleave
+        # its entries with ours and each would replay a different history
+        self.journal = open(self.journal_path, "a")
+        try:
+            fcntl.flock(self.journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.journal.close()
+            raise RuntimeError(
+                f"{self.journal_path} is in use by another process. The journal store is single-process; "
+                "run one worker, or set STRIKE_STORE=sqlite to share strikes between workers."
+            )
+        self.records = load_bannage_snapshot()
+        with open(self.journal_path, "rb+") as f:
+            complete = 0  # end of the last whole line
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn last line from a crash mid-write
+                complete += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["data"] is None:
+                    self.records.pop(entry["ip"], None)
+                else:
+                    self.records[entry["ip"]] = StrikeRecord.from_json(entry["data"])
+                self.entries += 1
+            # Cut the torn line off, so the next entry starts on a line of its own
+            f.truncate(complete)
+        now = time.time()
+        self.banned = {ip: data.cooldown_until for ip, data in self.records.items() if data.cooldown_until > now}
+        self.bans = [(cooldown_until, ip) for ip, cooldown_until in self.banned.items()]
+        heapq.heapify(self.bans)
+        return self.records
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
+
+    def save(self, ips):
+        with self.lock:
+            for ip in ips:
+                data = self.records.get(ip)
+                self.journal.write(json.dumps({"ip": ip, "data": data.to_json() if data is not None else None}) + "\n")
+            self.journal.flush()
+            self.entries += len(ips)
+            if self.entries >= JOURNAL_COMPACT_EVERY:
+                self.compact()
+
+    def compact(self):
+        # Fold the journal into a fresh snapshot and start the journal over
+        with self.lock:
+            with strike_table_lock:
+                snapshot = {ip: data.to_json() for ip, data in self.records.items()}
+            tmp_file = self.snapshot_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_file, self.snapshot_file)
+            self.journal.truncate(0)
+            self.entries = 0
+
+    def track_cooldown(self, ip, data):
+        # Called by strike_record whenever ip's cooldown changes or its record is
+        # removed (data is None)
+        with self.ban_lock:
+            if data is not None and data.cooldown_until > time.time():
+                self.banned[ip] = data.cooldown_until
+                heapq.heappush(self.bans, (data.cooldown_until, ip))
+            else:
+                self.banned.pop(ip, None)
+
+    def expire_bans(self, now):
+        # Pops expired bans off the top of the heap. Entries left behind by a
+        # re-ban to another time no longer match banned and are just dropped; the
+        # heap is rebuilt if they pile up.
+        while self.bans and self.bans[0][0] <= now:
+            cooldown_until, ip = heapq.heappop(self.bans)
+            if self.banned.get(ip) == cooldown_until:
+                del self.banned[ip]
+        if len(self.bans) > 2 * len(self.banned) + 64:
+            self.bans = [(cooldown_until, ip) for ip, cooldown_until in self.banned.items()]
+            heapq.heapify(self.bans)
+
+    def active_ban_count(self, now):
+        with self.ban_lock:
+            self.expire_bans(now)
+            return len(self.banned)
+
+    def active_bans(self, now, limit=None):
+        # Bans in cooldown order (the first limit of them), in O(active bans)
+        with self.ban_lock:
+            self.expire_bans(now)
+            if limit is None:
+                bans = sorted(self.banned.items(), key=lambda item: item[1])
+            else:
+                bans = heapq.nsmallest(limit, self.banned.items(), key=lambda item: item[1])
+        result = []
+        for ip, _ in bans:
+            data = self.records.get(ip)
+            if data is not None:
+                result.append((ip, data))
+        return result
+
+    def count(self):
+        return len(self.records)
+
+    # The in-memory records are the only copy, so there is nothing to re-read
+    def transaction(self):
+        return nullcontext()
+
+    def refresh(self, ip):
+        pass
+
+    def refresh_all(self, max_age=0):
+        pass
+
+    def get_challenge(self, ip):
+        return self.challenges.get(ip)
+
+    def set_challenge(self, ip, index):
+        self.challenges[ip] = index
+
+class SqliteStrikeStore:
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self.records = StrikeTable()
+        self.refreshed_at = 0
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS strikes ("
+            "ip TEXT PRIMARY KEY, strikes REAL NOT NULL, last_update REAL, cooldown_until REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS strikes_cooldown ON strikes (cooldown_until)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS password_challenges (ip TEXT PRIMARY KEY, idx INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def row_to_record(self, row):
+        return StrikeRecord(*row)
+
+    def load(self):
+        # The first start on SQLite brings the journal store's state over (the
+        # snapshot with the journal replayed on top), once: the "imported" meta row
+        # marks it done, so an empty table later (everything swept or unbanned)
+        # isn't refilled from the old files. Workers starting together queue on
+        # the write lock and the later ones find the marker already set.
+        with self.transaction():
+            imported = self.db.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone()
+            if imported is None:
+                empty = self.db.execute("SELECT 1 FROM strikes LIMIT 1").fetchone() is None
+                if empty and (os.path.exists(BANNAGE_FILE) or os.path.exists(BANNAGE_JOURNAL)):
+                    journal_store = JournalStrikeStore(BANNAGE_FILE, BANNAGE_JOURNAL)
+                    self.records = journal_store.load()
+                    journal_store.close()
+                    self.save(list(self.records))
+                self.db.execute("INSERT INTO meta (key, value) VALUES ('imported', 1)")
+            if self.db.execute("SELECT value FROM meta WHERE key = 'rows'").fetchone() is None:
+                # Row count for count(), kept up to date by save(); counted once here
+                self.db.execute("INSERT INTO meta (key, value) SELECT 'rows', COUNT(*) FROM strikes")
+            rows = self.db.execute("SELECT ip, strikes, last_update, cooldown_until FROM strikes").fetchall()
+        self.records = StrikeTable((row[0], self.row_to_record(row[1:])) for row in rows)
+        return self.records
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the database write lock up front, so a
+        # read-modify-write inside it can't interleave with another process.
+        # Nested uses join the outer transaction.
+        with self.lock:
+            if self.db.in_transaction:
+                yield
+                return
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def refresh(self, ip):
+        # Pull the current row into the in-memory record (updated in place, so
+        # references callers already hold stay current)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT strikes, last_update, cooldown_until FROM strikes WHERE ip = ?", (ip,)
+            ).fetchone()
+            with strike_table_lock:
+                if row is None:
+                    self.records.pop(ip, None)
+                elif ip in self.records:
+                    self.records[ip].assign(self.row_to_record(row))
+                else:
+                    self.records[ip] = self.row_to_record(row)
+
+    def refresh_all(self, max_age=0):
+        # max_age skips the reload if the last one was that recent (seconds)
+        if time.time() - self.refreshed_at < max_age:
+            return
+        with self.lock:
+            self.refreshed_at = time.time()
+            rows = self.db.execute("SELECT ip, strikes, last_update, cooldown_until FROM strikes").fetchall()
+            fresh = {row[0]: self.row_to_record(row[1:]) for row in rows}
+            with strike_table_lock:
+                for ip in list(self.records):
+                    if ip not in fresh:
+                        del self.records[ip]
+                for ip, data in fresh.items():
+                    if ip in self.records:
+                        self.records[ip].assign(data)
+                    else:
+                        self.records[ip] = data
+
+    # Bans come straight from the cooldown_until index, see active_bans
+    def track_cooldown(self, ip, data):
+        pass
+
+    def count(self):
+        # COUNT(*) would walk the whole table; the meta row is kept by save()
+        with self.lock:
+            return self.db.execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()[0]
+
+    def get_challenge(self, ip):
+        with self.lock:
+            row = self.db.execute("SELECT idx FROM password_challenges WHERE ip = ?", (ip,)).fetchone()
+        return row[0] if row else None
+
+    def set_challenge(self, ip, index):
+        with self.transaction():
+            self.db.execute(
+                "INSERT INTO password_challenges (ip, idx) VALUES (?, ?) "
+                "ON CONFLICT(ip) DO UPDATE SET idx = excluded.idx", (ip, index)
+            )
+
+    def save(self, ips):
+        with self.transaction():
+            added = 0
+            for ip in ips:
+                data = self.records.get(ip)
+                if data is None:
+                    added -= self.db.execute("DELETE FROM strikes WHERE ip = ?", (ip,)).rowcount
+                    continue
+                values = (data.strikes, data.last_update, data.cooldown_until, ip)
+                updated = self.db.execute(
+                    "UPDATE strikes SET strikes = ?, last_update = ?, cooldown_until = ? WHERE ip = ?", values
+                ).rowcount
+                if not updated:
+                    self.db.execute(
+                        "INSERT INTO strikes (strikes, last_update, cooldown_until, ip) VALUES (?, ?, ?, ?)", values
+                    )
+                    added += 1
+            if added:
+                self.db.execute("UPDATE meta SET value = value + ? WHERE key = 'rows'", (added,))
+
+    def active_ban_count(self, now):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM strikes WHERE cooldown_until > ?", (now,)).fetchone()[0]
+
+    def active_bans(self, now, limit=None):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT ip, strikes, last_update, cooldown_until FROM strikes "
+                "WHERE cooldown_until > ? ORDER BY cooldown_until LIMIT ?", (now, -1 if limit is None else limit)
+            ).fetchall()
+        return [(row[0], self.row_to_record(row[1:])) for row in rows]
+
+if STRIKE_STORE == "sqlite":
+    strike_store = SqliteStrikeStore(STRIKE_DB)
 else:
-    ip_strikes = {}
+    strike_store = JournalStrikeStore(BANNAGE_FILE, BANNAGE_JOURNAL)
+ip_strikes = strike_store.load()
+
+# Write-behind for strike changes (see save_bannage). STRIKE_FLUSH_MS=0 writes
+# every change through immediately instead. A shared store is always written
+# through, since other workers read it, and so is everything until
+# start_server() has started the flusher.
+STRIKE_FLUSH_MS = float(os.environ.get("STRIKE_FLUSH_MS", 500))
+STRIKE_FLUSH_MUTATIONS = int(os.environ.get("STRIKE_FLUSH_MUTATIONS", 256))
+dirty_ips = set()
+# Reentrant because flush_on_signal runs flush_bannage in the main thread, which
+# may be holding either lock when the signal arrives
+dirty_lock = threading.RLock()
+flush_lock = threading.RLock()
+flush_wakeup = threading.Event()
+previous_signal_handlers = {}
+write_behind = False
+
+# Idle IPs (strikes decayed to zero, cooldown over) are dropped from the strike
+# table every STRIKE_SWEEP_SECONDS; 0 turns the sweeper off
+STRIKE_SWEEP_SECONDS = float(os.environ.get("STRIKE_SWEEP_SECONDS", 300))
+sweep_stats = {"sweeps": 0, "evicted": 0, "last_evicted": 0, "last_sweep": 0}
 
 DECAY_RATE_PER_HOUR = 4
 MAX_STRIKES = 10245760
@@ -43,11 +389,145 @@ if os.path.exists(APPEALS_FILE):
 else:
     appeals_data = {}
 
-password_challenges = {}
-
 class Forced404(Exception):
     pass
 
+class LRUCache:
+    # Least-recently-used cache bounded by total value size (bytes, as reported
+    # by the caller) with a per-entry time to live
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, size, value = entry
+            if expires < time.time():
+                del self.entries[key]
+                self.size -= size
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (time.time() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size, _) = self.entries.popitem(last=False)
+                self.size -= old_size
+
+class MinuteStats:
+    # Running totals of a few counters plus one bucket per minute for the last
+    # `minutes` minutes, for the dashboard's throughput table. Per process.
+    def __init__(self, names, minutes):
+        self.names = names
+        self.minutes = minutes
+        self.totals = dict.fromkeys(names, 0)
+        self.buckets = deque()  # (minute, {name: count}), oldest first
+        self.lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        minute = int(time.time() // 60)
+        with self.lock:
+            if not self.buckets or self.buckets[-1][0] != minute:
+                self.buckets.append((minute, dict.fromkeys(self.names, 0)))
+                while self.buckets[0][0] <= minute - self.minutes:
+                    self.buckets.popleft()
+            self.buckets[-1][1][name] += amount
+            self.totals[name] += amount
+
+    def recent(self, minutes):
+        # The last `minutes` whole minutes as (minute start, counts), newest
+        # first, with quiet minutes filled in as zeros
+        current = int(time.time() // 60)
+        with self.lock:
+            by_minute = {minute: dict(counts) for minute, counts in self.buckets}
+        return [
+            (minute * 60, by_minute.get(minute, dict.fromkeys(self.names, 0)))
+            for minute in range(current, current - minutes, -1)
+        ]
+
+# Site-wide counters: every request, grid points classified by /check, tokens
+# charged for them, and bans issued (a cooldown starting on an IP that had none)
+STATS_MINUTES = 60
+site_stats = MinuteStats(("requests", "tiles", "tokens", "bans"), STATS_MINUTES)
+
+class Histogram:
+    # Prometheus-style histogram (cumulative buckets, sum, count), optionally
+    # split by one label
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self.series = {}  # label value -> [bucket counts..., +Inf count], sum
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.series.get(label_value) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self.series[label_value] = counts, total + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self.series.items()}
+        for label_value, (counts, total) in sorted(series.items(), key=lambda item: str(item[0])):
+            labels = f'{self.label}="{label_value}",' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            labels = "{" + labels.rstrip(",") + "}" if labels else ""
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+# /check instrumentation, served on /metrics. Phases: fit (radius fitting),
+# grid (classifying the points), encode, respond (building the response) and
+# stream (grid + encode for stream=1, timed as the body is sent).
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+check_phase_seconds = Histogram("check_phase_seconds", "Time spent in each phase of /check.", SECONDS_BUCKETS, "phase")
+check_seconds = Histogram("check_seconds", "Total /check time for requests that returned a grid.", SECONDS_BUCKETS)
+check_tiles = Histogram("check_tiles", "Grid points per /check.", (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000))
+check_tiles_per_second = Histogram(
+    "check_tiles_per_second", "Grid points per second of /check time.", (1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+)
+
+# /check result cache, off by default. Turning it on (CHECK_CACHE_MB=32, say)
+# anchors the grid at the center snapped to the step lattice (moves it by at most
+# step / 2) so nearby repeats share an entry, which changes the output slightly;
+# with it off the grid keeps the exact request center.
+CHECK_CACHE_MB = float(os.environ.get("CHECK_CACHE_MB", 0))
+CHECK_CACHE_TTL = float(os.environ.get("CHECK_CACHE_TTL", 600))
+check_cache = LRUCache(CHECK_CACHE_MB * 1024 * 1024, CHECK_CACHE_TTL) if CHECK_CACHE_MB > 0 else None
+
+# Aligned-grid mode (aligned=1, or CHECK_ALIGNED=1 for the default): the grid sits
+# on the global lattice row * step / col * step and is put together from
+# TILE_SIZE x TILE_SIZE tiles cached per focus level, so overlapping requests only
+# compute the tiles they haven't seen yet.
+CHECK_ALIGNED = os.environ.get("CHECK_ALIGNED", "0") == "1"
+TILE_SIZE = 64
+TILE_CACHE_MB = float(os.environ.get("TILE_CACHE_MB", 64))
+tile_cache = LRUCache(TILE_CACHE_MB * 1024 * 1024, CHECK_CACHE_TTL) if TILE_CACHE_MB > 0 else None
+
+# stream=1 on /check classifies and sends this many grid rows at a time
+STREAM_BAND_ROWS = 16
+
 #######################################################################################################################################################
 #######################################################################################################################################################
 
@@ -58,9 +538,221 @@ def get_client_ip():
 def is_whitelisted(ip):
     return ip in WHITELISTED_IPS
 
-def save_bannage():
-    with open(BANNAGE_FILE, "w") as f:
-        json.dump(ip_strikes, f)
+def save_bannage(*ips):
+    # Marks the IPs dirty; the flusher thread writes their current records to the
+    # strike store every STRIKE_FLUSH_MS or once STRIKE_FLUSH_MUTATIONS pile up
+    if not write_behind:
+        strike_store.save(ips)
+        return
+    with dirty_lock:
+        dirty_ips.update(ips)
+        if len(dirty_ips) >= STRIKE_FLUSH_MUTATIONS:
+            flush_wakeup.set()
+
+def flush_bannage():
+    with flush_lock:
+        with dirty_lock:
+            ips = list(dirty_ips)
+            dirty_ips.clear()
+        if ips:
+            try:
+                strike_store.save(ips)
+            except Exception:
+                with dirty_lock:
+                    dirty_ips.update(ips)
+                raise
+
+def bannage_flusher():
+    while True:
+        flush_wakeup.wait(STRIKE_FLUSH_MS / 1000)
+        flush_wakeup.clear()
+        try:
+            flush_bannage()
+        except Exception as e:
+            print("Strike flush failed:", e)
+
+def is_idle(user, now):
+    return current_strikes(user, now) == 0 and user.cooldown_until <= now
+
+def sweep_idle_ips():
+    # Candidates come from a snapshot of the table; each one is checked again
+    # under its own strike_record before it goes, in case it picked up a strike
+    # in the meantime
+    strike_store.refresh_all()
+    now = time.time()
+    candidates = [ip for ip, data in strike_table_items() if is_idle(data, now)]
+    evicted = 0
+    for ip in candidates:
+        with strike_record(ip, create=False) as user:
+            if user is not None and is_idle(user, time.time()):
+                delete_strike_record(ip)
+                evicted += 1
+    sweep_stats["sweeps"] += 1
+    sweep_stats["evicted"] += evicted
+    sweep_stats["last_evicted"] = evicted
+    sweep_stats["last_sweep"] = now
+    return evicted
+
+def idle_sweeper():
+    while True:
+        time.sleep(STRIKE_SWEEP_SECONDS)
+        try:
+            sweep_idle_ips()
+        except Exception as e:
+            print("Idle IP sweep failed:", e)
+
+def flush_on_signal(signum, frame):
+    flush_bannage()
+    previous = previous_signal_handlers.get(signum)
+    if previous is signal.SIG_IGN:
+        return  # e.g. SIGHUP under nohup: flushed, and otherwise still ignored
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+def strike_lock(ip):
+    return strike_locks[hash(ip) % STRIKE_LOCK_STRIPES]
+
+def strike_table_items():
+    # Snapshot of (ip, record) pairs that's safe to walk while requests go on
+    with strike_table_lock:
+        return list(ip_strikes.items())
+
+def set_strike_record(ip, user):
+    with strike_table_lock:
+        ip_strikes[ip] = user
+
+def delete_strike_record(ip):
+    with strike_table_lock:
+        ip_strikes.pop(ip, None)
+
+@contextmanager
+def strike_record(ip, create=True):
+    # Read-modify-write of one IP's strike record. The block holds the IP's stripe
+    # lock, so threads in this process can't interleave updates to it, and runs
+    # in one store transaction after re-reading the record, so with a shared
+    # store other workers can't either. The block may also replace or delete the
+    # record (set_strike_record / delete_strike_record); any change gets saved.
+    with strike_lock(ip), strike_store.transaction():
+        strike_store.refresh(ip)
+        user = ip_strikes.get(ip)
+        if user is None and create:
+            user = StrikeRecord(0, time.time(), 0)
+            set_strike_record(ip, user)
+            before = None
+        else:
+            before = user.copy() if user is not None else None
+        if user:
+            settle_strikes(user, time.time())
+        yield user
+        after = ip_strikes.get(ip)
+        if after is None:
+            if before is not None:
+                strike_store.track_cooldown(ip, None)
+        elif before is None or after.cooldown_until != before.cooldown_until:
+            strike_store.track_cooldown(ip, after)
+            now = time.time()
+            if after.cooldown_until > now and (before is None or before.cooldown_until <= now):
+                site_stats.add("bans")
+        if after is not user or (user is not None and user != before):
+            save_bannage(ip)
+
+def read_strike_record(ip):
+    # A copy of the record with the strike count decayed to now; nothing is written
+    with strike_lock(ip):
+        strike_store.refresh(ip)
+        user = ip_strikes.get(ip)
+        if user is None:
+            return None
+        user = user.copy()
+    user.strikes = current_strikes(user)
+    return user
+
+def get_password_challenge(ip):
+    return strike_store.get_challenge(ip)
+
+def set_password_challenge(ip, index):
+    strike_store.set_challenge(ip, index)
+
+def active_banlist(bans=None):
+    if bans is None:
+        bans = strike_store.active_bans(time.time())
+    banlist = []
+    for banned_ip, data in bans:
+        banlist.append({
+            "ip": banned_ip,
+            "strikes": current_strikes(data),
+            "cooldown": datetime.fromtimestamp(data.cooldown_until).strftime("%Y-%m-%d %H:%M:%S")
+        })
+    return banlist
+
+# Admin dashboard listing (/dashboard/strikes)
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE = 500
+DASHBOARD_REFRESH_SECONDS = 5  # how stale a shared store's table may be for it
+
+def strike_page(prefix="", sort="ip", min_strikes=0, banned_only=False, offset=0, limit=DASHBOARD_PAGE_SIZE):
+    # One page of the strike table as (total matching, rows). The prefix narrows
+    # the sorted IP index first; with no other filter and IP order the page is a
+    # straight slice of it. Banned-only listings and the top of the cooldown order
+    # come from the store's active bans (the ban heap, or the cooldown_until index)
+    # instead of the table. Anything else (the strikes order, min_strikes, cooldown
+    # pages past the active bans) filters every IP in the prefix range and takes
+    # the top offset + limit with a heap, not a full sort.
+    now = time.time()
+    if banned_only or sort == "cooldown":
+        bans = [
+            (ip, user, current_strikes(user, now)) for ip, user in strike_store.active_bans(now)
+            if ip.startswith(prefix)
+        ]
+        bans = [row for row in bans if row[2] >= min_strikes]
+        bans.reverse()  # latest cooldown first
+        if banned_only:
+            if sort == "strikes":
+                page = heapq.nlargest(offset + limit, bans, key=lambda row: row[2])[offset:]
+            elif sort == "ip":
+                page = sorted(bans, key=lambda row: row[0])[offset:offset + limit]
+            else:
+                page = bans[offset:offset + limit]
+            return len(bans), [strike_row(ip, user, now) for ip, user, _ in page]
+        if not min_strikes and offset + limit <= len(bans):
+            with strike_table_lock:
+                lo, hi = ip_strikes.prefix_range(prefix)
+            return hi - lo, [strike_row(ip, user, now) for ip, user, _ in bans[offset:offset + limit]]
+
+    with strike_table_lock:
+        lo, hi = ip_strikes.prefix_range(prefix)
+        if sort == "ip" and not min_strikes:
+            ips = ip_strikes.index[lo + offset:min(hi, lo + offset + limit)]
+            return hi - lo, [strike_row(ip, ip_strikes[ip], now) for ip in ips]
+        matches = [(ip, ip_strikes[ip]) for ip in ip_strikes.index[lo:hi]]
+
+    rows = []
+    for ip, user in matches:
+        strikes = current_strikes(user, now)
+        if strikes < min_strikes:
+            continue
+        rows.append((ip, user, strikes))
+    if sort == "strikes":
+        page = heapq.nlargest(offset + limit, rows, key=lambda row: row[2])[offset:]
+    elif sort == "cooldown":
+        page = heapq.nlargest(offset + limit, rows, key=lambda row: row[1].cooldown_until)[offset:]
+    else:
+        page = rows[offset:offset + limit]
+    return len(rows), [strike_row(ip, user, now) for ip, user, _ in page]
+
+def strike_row(ip, user, now):
+    strikes = current_strikes(user, now)
+    return {
+        "ip": ip,
+        "strikes": strikes,
+        "tokens_left": 64 - strikes,
+        "cooldown_until": user.cooldown_until,
+        "cooldown": datetime.fromtimestamp(user.cooldown_until).strftime("%Y-%m-%d %H:%M:%S"),
+        "banned": user.cooldown_until > now,
+    }
 
 def save_appeals():
     with open(APPEALS_FILE, "w") as f:
@@ -72,17 +764,32 @@ def format_timestamp(timestamp):
     except Exception:
         return "???"
 
-def decay_strikes(ip):
-    now = time.time()
-    user = ip_strikes.get(ip)
-    if not user:
-        ip_strikes[ip] = {"strikes": 0, "last_update": now, "cooldown_until": 0}
-        return
-
-    time_passed = (now - user.get("last_update", now)) / 3600
-    decay = int(time_passed * DECAY_RATE_PER_HOUR)
-    user["strikes"] = max(0, user.get("strikes", 0) - decay)
-    user["last_update"] = now
+# Strikes decay lazily: a record holds the count as of last_update, and the
+# current count is worked out when it's read. Only real changes write.
+def decay_steps(user, now):
+    if user.last_update is None:
+        return 0
+    hours = (now - user.last_update) / 3600
+    return max(0, int(hours * DECAY_RATE_PER_HOUR))
+
+def current_strikes(user, now=None):
+    if now is None:
+        now = time.time()
+    return max(0, user.strikes - decay_steps(user, now))
+
+def settle_strikes(user, now):
+    # Folds the decay so far into the stored count before it's changed. Partial
+    # progress towards the next decay step is kept by only moving last_update
+    # forward by whole steps.
+    steps = decay_steps(user, now)
+    if user.last_update is None:
+        user.last_update = now
+    elif steps:
+        user.strikes = max(0, user.strikes - steps)
+        if user.strikes == 0:
+            user.last_update = now
+        else:
+            user.last_update += steps * 3600 / DECAY_RATE_PER_HOUR
     
 def migrate_appeals():
     pass  # Implement migration logic if needed
@@ -91,19 +798,13 @@ def add_strike(ip, points):
     if is_whitelisted(ip):
         return  # Skip strike logic
     now = time.time()
-    decay_strikes(ip)
-    user = ip_strikes[ip]
-    user["strikes"] += points
-    cooldown_quadrants = user["strikes"] - 128
-    cooldown_remaining = max(0, int((user.get("cooldown_until", 0) - now) / 60))
-    cooldown_until = user.get("cooldown_until", 0)
-    cooldown_remaining_seconds = max(0, int(cooldown_until - now))
-    if cooldown_quadrants > 0.01:
-        user["cooldown_until"] = now + cooldown_quadrants * 900  # 15 mins per quadrant
-    else:
-        user["cooldown_until"] = now + cooldown_quadrants * 900  # 15 mins per quadrant
-
-    save_bannage()
+    with strike_record(ip) as user:
+        user.strikes += points
+        cooldown_quadrants = user.strikes - 128
+        if cooldown_quadrants > 0.01:
+            user.cooldown_until = now + cooldown_quadrants * 900  # 15 mins per quadrant
+        else:
+            user.cooldown_until = now + cooldown_quadrants * 900  # 15 mins per quadrant
 
 def format_ban_time(minutes):
     result = []
@@ -139,49 +840,95 @@ def format_ban_time(minutes):
 def is_throttled(ip):
     if is_whitelisted(ip):
         return False, 0
-    user = ip_strikes.get(ip)
+    user = read_strike_record(ip)
     now = time.time()
     if not user:
         return False, 0
-    if user["strikes"] >= 768 and user.get("cooldown_until", 0) > now:
-        prev = user["strikes"]
-        user["strikes"] = min(int(prev * 1.15) + 5, MAX_STRIKES)
-        save_bannage()
+    if user.strikes >= 768 and user.cooldown_until > now:
+        with strike_record(ip) as user:
+            prev = user.strikes
+            user.strikes = min(int(prev * 1.15) + 5, MAX_STRIKES)
         raise Forced404
-    if user["strikes"] >= 128 and user.get("cooldown_until", 0) > now:
-        remaining = int((user["cooldown_until"] - now) / 60) + 1
+    if user.strikes >= 128 and user.cooldown_until > now:
+        remaining = int((user.cooldown_until - now) / 60) + 1
         return True, remaining
     return False, 0
 
 def check_password(ip, password):
-    challenge_index = password_challenges.get(ip, None)
+    challenge_index = get_password_challenge(ip)
     if challenge_index is None or challenge_index >= len(ADMIN_PASSWORDS):
         return False
     expected_password = ADMIN_PASSWORDS[challenge_index]
     return password == expected_password
 
-def is_point_in_water(lat, lon):
-    point = Point(lon, lat)
-    return any(water_shape.intersects(point) for water_shape in water_shapes)
-
-def encode_runs(bits):
-    if not bits:
-        return ""
-
-    result = []
-    current_bit = bits[0]
-    count = 1
-
-    for b in bits[1:]:
-        if b == current_bit and count < 0xFFFF:
-            count += 1
-        else:
-            result.append(f"{int(current_bit)}x{count:04X}")
-            current_bit = b
-            count = 1
-
-    result.append(f"{int(current_bit)}x{count:04X}")
-    return '.'.join(result)
+def water_tile(focus_level, tile_row, tile_col):
+    key = (focus_level, tile_row, tile_col)
+    packed = tile_cache.get(key) if tile_cache is not None else None
+    if packed is None:
+        step = FOCUS_STEP_MAP[focus_level]
+        rows = np.arange(tile_row * TILE_SIZE, (tile_row + 1) * TILE_SIZE)
+        cols = np.arange(tile_col * TILE_SIZE, (tile_col + 1) * TILE_SIZE)
+        packed = np.packbits(water_grid(rows * step, cols * step))
+        if tile_cache is not None:
+            tile_cache.put(key, packed, packed.nbytes + 100)
+    return np.unpackbits(packed, count=TILE_SIZE * TILE_SIZE).reshape(TILE_SIZE, TILE_SIZE).astype(bool)
+
+def aligned_water_block(focus_level, row0, col0, height, width):
+    # Lattice rows row0.. and columns col0.. (global indices), copied out of the
+    # tiles they overlap
+    row1, col1 = row0 + height, col0 + width
+    result = np.zeros((height, width), dtype=bool)
+
+    for tile_row in range(row0 // TILE_SIZE, (row1 - 1) // TILE_SIZE + 1):
+        for tile_col in range(col0 // TILE_SIZE, (col1 - 1) // TILE_SIZE + 1):
+            tile = water_tile(focus_level, tile_row, tile_col)
+            top, left = tile_row * TILE_SIZE, tile_col * TILE_SIZE
+            r_lo, r_hi = max(row0, top), min(row1, top + TILE_SIZE)
+            c_lo, c_hi = max(col0, left), min(col1, left + TILE_SIZE)
+            result[r_lo - row0:r_hi - row0, c_lo - col0:c_hi - col0] = \
+                tile[r_lo - top:r_hi - top, c_lo - left:c_hi - left]
+    return result
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        check_phase_seconds.observe(time.perf_counter() - started, phase)
+
+def observe_check(started, tiles):
+    elapsed = time.perf_counter() - started
+    check_seconds.observe(elapsed)
+    check_tiles.observe(tiles)
+    if elapsed > 0:
+        check_tiles_per_second.observe(tiles / elapsed)
+
+def metrics_text():
+    lines = []
+    for name, help_text in (
+        ("requests", "Requests served."),
+        ("tiles", "Grid points classified by /check."),
+        ("tokens", "Tokens charged by /check."),
+        ("bans", "Bans issued."),
+    ):
+        lines += [f"# HELP site_{name}_total {help_text}", f"# TYPE site_{name}_total counter",
+                  f"site_{name}_total {site_stats.totals[name]}"]
+    for name, help_text, value in (
+        ("strike_evictions_total", "Idle IPs evicted from the strike table.", sweep_stats["evicted"]),
+        ("strike_sweeps_total", "Idle-IP sweeps run.", sweep_stats["sweeps"]),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+    for name, help_text, value in (
+        ("strike_table_ips", "IPs in the strike table.", strike_store.count()),
+        ("active_bans", "IPs currently in cooldown.", strike_store.active_ban_count(time.time())),
+        ("check_cache_bytes", "Size of the /check result cache.", check_cache.size if check_cache is not None else 0),
+        ("tile_cache_bytes", "Size of the aligned-grid tile cache.", tile_cache.size if tile_cache is not None else 0),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    for histogram in (check_phase_seconds, check_seconds, check_tiles, check_tiles_per_second):
+        lines += histogram.render()
+    return "\n".join(lines) + "\n"
 
 def is_admin():
     ip = get_client_ip()
@@ -205,23 +952,25 @@ def validate_radius(radius_miles, ip):
 #######################################################################################################################################################
 #######################################################################################################################################################
 
+@app.before_request
+def count_request():
+    site_stats.add("requests")
+
 @app.route("/appeal", methods=["GET", "POST"])
 def appeal():
     ip = get_client_ip()
-    decay_strikes(ip)
     add_strike(ip, 2.25)
-    user = ip_strikes.get(ip, {})
+    user = read_strike_record(ip) or StrikeRecord()
     now = time.time()
-    cooldown_remaining = max(0, int((user.get("cooldown_until", 0) - now) / 60))
+    cooldown_remaining = max(0, int((user.cooldown_until - now) / 60))
     throttled, minutes = is_throttled(ip)
 
-    if user.get("strikes", 0) >= 76800 and user.get("cooldown_until", 0) > now:
-        prev = user["strikes"]
-        user["strikes"] = min(int(prev * 1.15) + 5, MAX_STRIKES)
-        save_bannage()
+    if user.strikes >= 76800 and user.cooldown_until > now:
+        with strike_record(ip) as user:
+            prev = user.strikes
+            user.strikes = min(int(prev * 1.15) + 5, MAX_STRIKES)
         raise Forced404    
     if throttled:
-        decay_strikes(ip)
         return redirect(url_for("banned"))
 
     if request.method == "GET":
@@ -262,27 +1011,25 @@ def appeal():
 @app.route("/banned")
 def banned():
     ip = get_client_ip()
-    decay_strikes(ip)
     add_strike(ip, 2)
-    user = ip_strikes.get(ip, {"cooldown_until": 0, "strikes": 0})
     now = time.time()
-    prev = user.get("strikes", 0)
-    user["strikes"] = min(int(prev * 1.15) + 2, MAX_STRIKES)
-    save_bannage()
-    cooldown_remaining = max(0, int((user.get("cooldown_until", 0) - now) / 60))
-    cooldown_until = user.get("cooldown_until", 0)
+    with strike_record(ip) as user:
+        prev = user.strikes
+        user.strikes = min(int(prev * 1.15) + 2, MAX_STRIKES)
+    cooldown_remaining = max(0, int((user.cooldown_until - now) / 60))
+    cooldown_until = user.cooldown_until
     cooldown_remaining_seconds = max(0, int(cooldown_until - now))
 
-    if user["strikes"] >= 2048 and cooldown_until > now: # because sometimes you're hitting 256 with only one command.
-        prev = user["strikes"]
-        user["strikes"] = min(int(prev * 1.4) + 5, MAX_STRIKES)
-        save_bannage()
+    if user.strikes >= 2048 and cooldown_until > now: # because sometimes you're hitting 256 with only one command.
+        with strike_record(ip) as user:
+            prev = user.strikes
+            user.strikes = min(int(prev * 1.4) + 5, MAX_STRIKES)
         raise Forced404
 
     if cooldown_remaining_seconds <= 0:
         return render_template("404.html"), 404
 
-    cooldown_until = user.get("cooldown_until", 0)
+    cooldown_until = user.cooldown_until
     now = time.time()
     bantime_remaining = max(0, int(cooldown_until - now))  # in seconds
 
@@ -296,21 +1043,19 @@ def dashboard():
 
     if not is_admin_user:
         add_strike(ip, 0.7)
-        decay_strikes(ip)
         throttled, minutes = is_throttled(ip)
 
         if throttled:
-            user = ip_strikes[ip]
-            prev = user["strikes"]
-            user["strikes"] = min(int(prev * 1.15) + 2, MAX_STRIKES)
-            save_bannage()
+            with strike_record(ip) as user:
+                prev = user.strikes
+                user.strikes = min(int(prev * 1.15) + 2, MAX_STRIKES)
             return redirect(url_for("banned"))
 
-    user = ip_strikes.get(ip, {})
-    strikes = user.get("strikes", 0)
+    user = read_strike_record(ip) or StrikeRecord()
+    strikes = user.strikes
     tokens_left = max(0, 128 - strikes)
-    cooldown_time = datetime.fromtimestamp(user.get("cooldown_until", 0)).strftime("%Y-%m-%d %H:%M:%S")
-    cooldown_until = user.get("cooldown_until", 0)
+    cooldown_time = datetime.fromtimestamp(user.cooldown_until).strftime("%Y-%m-%d %H:%M:%S")
+    cooldown_until = user.cooldown_until
     now = time.time()
     cooldown_remaining_seconds = max(0, int(cooldown_until - now))
     cooldown_remaining_minutes = cooldown_remaining_seconds // 60
@@ -318,17 +1063,15 @@ def dashboard():
     password_index = None
     if is_admin_user:
         password_index = random.randint(0, len(ADMIN_PASSWORDS)-1)
-        password_challenges[ip] = password_index
+        set_password_challenge(ip, password_index)
 
     banlist = []
+    banned_count = 0
     if is_admin_user:
-        for banned_ip, data in ip_strikes.items():
-            if data.get("cooldown_until", 0) > time.time():
-                banlist.append({
-                    "ip": banned_ip,
-                    "strikes": data.get("strikes", 0),
-                    "cooldown": datetime.fromtimestamp(data["cooldown_until"]).strftime("%Y-%m-%d %H:%M:%S")
-                })
+        # Only the first page of bans is rendered; the users list pages through
+        # the rest (Banned only)
+        banned_count = strike_store.active_ban_count(time.time())
+        banlist = active_banlist(strike_store.active_bans(time.time(), limit=DASHBOARD_PAGE_SIZE))
 
     appeals_log = []
     if is_admin_user:
@@ -351,25 +1094,52 @@ def dashboard():
         cooldown_time=cooldown_time,
         is_admin=is_admin_user,
         banlist=banlist,
-        total_users=len(ip_strikes),
-        banned_count=len(banlist),
+        total_users=strike_store.count(),
+        banned_count=banned_count,
         total_appeals=len(appeals_data),
         appeals_log=appeals_log,
         password_index=password_index,
-        ip_strikes=ip_strikes
+        page_size=DASHBOARD_PAGE_SIZE,
+        stats_totals=site_stats.totals,
+        stats_recent=[(datetime.fromtimestamp(minute).strftime("%H:%M"), counts) for minute, counts in site_stats.recent(15)],
+        sweep_stats=sweep_stats
         )
+@app.route("/dashboard/strikes")
+def dashboard_strikes():
+    # JSON pages of the strike table for the admin dashboard
+    ip = get_client_ip()
+    if ip not in WHITELISTED_IPS:
+        raise Forced404
+
+    sort = request.args.get("sort", "ip")
+    if sort not in ("ip", "strikes", "cooldown"):
+        return jsonify({"error": "P400", "message": "sort must be ip, strikes or cooldown."}), 400
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = min(max(1, request.args.get("limit", DASHBOARD_PAGE_SIZE, type=int)), DASHBOARD_MAX_PAGE)
+
+    strike_store.refresh_all(max_age=DASHBOARD_REFRESH_SECONDS)
+    total, rows = strike_page(
+        prefix=request.args.get("prefix", "").strip(),
+        sort=sort,
+        min_strikes=request.args.get("min_strikes", 0, type=float),
+        banned_only=request.args.get("banned") == "1",
+        offset=offset,
+        limit=limit,
+    )
+    return jsonify({"total": total, "offset": offset, "limit": limit, "rows": rows})
+
 @app.route("/unban", methods=["GET", "POST"])
 def unban():
     ip = get_client_ip()
     is_admin = ip in WHITELISTED_IPS
     if not is_admin:
-        user = ip_strikes.get(ip, {"strikes": 0})
-        prev = user["strikes"]
-        user["strikes"] = min(int(prev * 4) + 10, MAX_STRIKES)
-        save_bannage()
+        with strike_record(ip, create=False) as user:
+            if user is not None:
+                prev = user.strikes
+                user.strikes = min(int(prev * 4) + 10, MAX_STRIKES)
         raise Forced404
 
-    index = password_challenges.get(ip, None)
+    index = get_password_challenge(ip)
     if index is None:
         return render_template("403.html"), 403
 
@@ -381,12 +1151,13 @@ def unban():
         if password != expected_password:
             return render_template("403.html"), 403
 
-        if target_ip in ip_strikes:
-            del ip_strikes[target_ip]
+        with strike_record(target_ip, create=False) as target:
+            if target is not None:
+                delete_strike_record(target_ip)
+        if target is not None:
             if target_ip in appeals_data:
                 del appeals_data[target_ip]
                 save_appeals()
-            save_bannage()
             return redirect(url_for("dashboard"))
         else:
             return render_template("404.html"), 404
@@ -395,14 +1166,7 @@ def unban():
     suffix = ["st", "nd", "rd"] + ["th"] * 10
     suffix_str = suffix[index] if index < len(suffix) else "th"
 
-    banlist = []
-    for banned_ip, data in ip_strikes.items():
-        if data.get("cooldown_until", 0) > time.time():
-            banlist.append({
-                "ip": banned_ip,
-                "strikes": data.get("strikes", 0),
-                "cooldown": datetime.fromtimestamp(data["cooldown_until"]).strftime("%Y-%m-%d %H:%M:%S")
-            })
+    banlist = active_banlist()
 
     return render_template("unban_form.html", banlist=banlist, password_index=index, suffix=suffix_str)
 
@@ -417,7 +1181,7 @@ def delete_appeal_by_index():
     password = request.form.get("password", "")
     index = request.form.get("index", None)
 
-    challenge_index = password_challenges.get(ip, None)
+    challenge_index = get_password_challenge(ip)
     if challenge_index is None or challenge_index >= len(ADMIN_PASSWORDS):
         return render_template("403.html"), 403
 
@@ -449,10 +1213,10 @@ def ban_ip():
     ip = get_client_ip()
     is_admin = ip in WHITELISTED_IPS
     if not is_admin:
-        user = ip_strikes.get(ip, {"strikes": 0})
-        prev = user.get("strikes", 0)
-        user["strikes"] = min(int(prev * 4) + 10, MAX_STRIKES)
-        save_bannage()
+        with strike_record(ip, create=False) as user:
+            if user is not None:
+                prev = user.strikes
+                user.strikes = min(int(prev * 4) + 10, MAX_STRIKES)
         raise Forced404
 
     target_ip = request.form.get("ip")
@@ -475,25 +1239,22 @@ def ban_ip():
     cooldown_hours = 24
     cooldown_until = now + cooldown_hours * 3600
 
-    ip_strikes[target_ip] = {
-        "strikes": total_strikes,
-        "cooldown_until": cooldown_until
-    }
-    save_bannage()
+    with strike_record(target_ip, create=False):
+        set_strike_record(target_ip, StrikeRecord(total_strikes, None, cooldown_until))
 
     flash(f"Banned {target_ip} with {total_strikes} strikes for {cooldown_hours} hours!")
     return redirect(url_for("dashboard"))
 
 @app.route("/check", methods=["GET"])
 def check():
+    started = time.perf_counter()
     admin_bonus = 0
     ip = get_client_ip()
-    decay_strikes(ip)
     add_strike(ip, 0.01)
-    user = ip_strikes.get(ip, {})
+    user = read_strike_record(ip) or StrikeRecord()
     now = time.time()
-    cooldown_remaining = max(0, int((user.get("cooldown_until", 0) - now) / 60))
-    cooldown_until = user.get("cooldown_until", 0)
+    cooldown_remaining = max(0, int((user.cooldown_until - now) / 60))
+    cooldown_until = user.cooldown_until
     cooldown_remaining_seconds = max(0, int(cooldown_until - now))
     cooldown_remaining_minutes = cooldown_remaining_seconds // 60
     throttled, minutes = is_throttled(ip)
@@ -501,11 +1262,9 @@ def check():
     if is_admin:
         admin_bonus = 2000
     if throttled:
-        decay_strikes(ip)
-        user = ip_strikes[ip]
-        prev = user["strikes"]
-        user["strikes"] = min(int(prev * 1.25) + 2, MAX_STRIKES)
-        save_bannage()
+        with strike_record(ip) as user:
+            prev = user.strikes
+            user.strikes = min(int(prev * 1.25) + 2, MAX_STRIKES)
         timetime = format_ban_time(cooldown_remaining)
         return redirect(url_for("banned"))
 
@@ -514,6 +1273,7 @@ def check():
         lon = float(request.args.get("lon"))
         radius_miles = float(request.args.get("radius_miles", 10))
         focus_mode_raw = request.args.get("focusmode", "0")
+        lookup = request.args.get("lookup", WATER_LOOKUP)
 
         # Try to interpret the value safely
         try:
@@ -524,99 +1284,164 @@ def check():
         # Clamp between 0 and 4
         focus_level = max(0, min(5, focus_level))
 
-        # Map focus level to step size
-        focus_step_map = {
-            0: 0.025,
-            1: 0.016,
-            2: 0.010,
-            3: 0.007,
-            4: 0.0047,
-            5: 0.0033
-        }
-
-        step = focus_step_map[focus_level]
+        step = FOCUS_STEP_MAP[focus_level]
 
         # Optional: increase token cost for higher focus levels
         token_multiplier = 1.0 + focus_level * 0.2  # e.g. 1.0, 1.15, 1.3, etc.
 
         tiles_per_token = 525
         max_tokens = 128 + 256 + admin_bonus
-        tokens_available = max_tokens - user.get("strikes", 0)
-
-        def estimate_tile_count(radius_miles, step):
-            radius_deg = radius_miles / 69.0
-            lat_range = int(radius_deg / step)
-            lon_range = int(radius_deg / step)
-            return (2 * lat_range + 1) * (2 * lon_range + 1)
-
-        while radius_miles > 0.1:
-            tile_est = estimate_tile_count(radius_miles, step)
-            token_est = round((tile_est / tiles_per_token) * token_multiplier, 2)
-            if token_est <= tokens_available:
-                break
-            radius_miles = round(radius_miles - 0.1, 1)
-        else:
+        tokens_available = max_tokens - user.strikes
+
+        with timed("fit"):
+            fitted = fit_radius(radius_miles, step, tokens_available, tiles_per_token, token_multiplier)
+        if fitted is None:
             return jsonify({
                 "error": "NOT_ENOUGH_TOKENS",
                 "message": "You don't have enough tokens."
             }), 403
+        radius_miles, tile_est, token_est = fitted
 
         tile_count = tile_est
         token_cost = token_est
 
         # Deduct tokens after adjusting radius
         add_strike(ip, token_cost)
+        site_stats.add("tokens", token_cost)
 
         radius_deg = radius_miles / 69.0
         lat_range = int(radius_deg / step)
         lon_range = int(radius_deg / step)
 
-        result_bits = []
-        checked_tiles = 0
-
-        for dy in range(-lat_range, lat_range + 1):
-            for dx in range(-lon_range, lon_range + 1):
-                new_lat = lat + dy * step
-                new_lon = lon + dx * step
-                result_bits.append(int(is_point_in_water(new_lat, new_lon)))
-                checked_tiles += 1
-
-        encoded = encode_runs(result_bits)
-        user = ip_strikes.get(ip, {})
-        tokens_left = round(max(0, 128 - user.get("strikes", 0)), 2)
+        use_raster = lookup == "raster" and focus_level in water_rasters
+        aligned = request.args.get("aligned", "1" if CHECK_ALIGNED else "0") == "1"
+        if check_cache is not None or aligned:
+            lat_index = round(lat / step)
+            lon_index = round(lon / step)
+            lat = lat_index * step
+            lon = lon_index * step
 
         accept = request.headers.get("Accept", "").lower()
         ua = request.headers.get("User-Agent", "").lower()
+        wants_binary = request.args.get("format") == "bin" or "application/octet-stream" in accept
+        encoding = "text"
+        if wants_binary:
+            encoding = request.args.get("encoding", "auto")
+            if encoding not in ("auto", "bits", "runs"):
+                encoding = "auto"
+
+        height = 2 * lat_range + 1
+        width = 2 * lon_range + 1
+        if use_raster:
+            raster_row, raster_col = raster_origin(focus_level, lat, lon)
+
+            def grid_rows(start, stop):
+                return raster_block(focus_level, raster_row - lat_range + start, raster_col - lon_range, stop - start, width)
+        elif aligned:
+            def grid_rows(start, stop):
+                return aligned_water_block(focus_level, lat_index - lat_range + start, lon_index - lon_range, stop - start, width)
+        else:
+            grid_lats, grid_lons = grid_axes(lat, lon, step, lat_range, lon_range)
+
+            def grid_rows(start, stop):
+                return water_grid(grid_lats[start:stop], grid_lons)
+
+        if request.args.get("stream") == "1" and not wants_binary:
+            # Classified and sent a band of rows at a time, skipping the cache.
+            # Only the text body streams; a client that asked for binary gets the
+            # whole binary body below instead.
+            user = read_strike_record(ip) or StrikeRecord()
+            tokens_left = round(max(0, 128 - user.strikes), 2)
+
+            def generate():
+                site_stats.add("tiles", height * width)
+                bands = (grid_rows(start, min(start + STREAM_BAND_ROWS, height))
+                         for start in range(0, height, STREAM_BAND_ROWS))
+                with timed("stream"):
+                    yield from stream_runs(bands)
+                observe_check(started, height * width)
+                yield (
+                    f"\n\n"
+                    f"Tiles checked: {height * width}\n"
+                    f"Radius used: {radius_miles} miles\n"
+                    f"Tokens used: {token_cost}\n"
+                    f"Tokens left: {tokens_left}/128\n"
+                    f"(1 token regenerates every ~15 minutes.)"
+                )
+
+            return Response(stream_with_context(generate()), 200, {'Content-Type': 'text/plain; charset=utf-8'})
+
+        cached = None
+        if check_cache is not None:
+            cache_key = (lat_index, lon_index, lat_range, focus_level, use_raster, aligned, encoding)
+            cached = check_cache.get(cache_key)
+
+        if cached is not None:
+            encoded, checked_tiles = cached
+        else:
+            with timed("grid"):
+                water = grid_rows(0, height)
+            checked_tiles = water.size
+
+            with timed("encode"):
+                if wants_binary:
+                    encoded = encode_binary(water, encoding)
+                else:
+                    encoded = encode_runs(water)
+            if check_cache is not None:
+                check_cache.put(cache_key, (encoded, checked_tiles), len(encoded) + 100)
+        site_stats.add("tiles", checked_tiles)
+        user = read_strike_record(ip) or StrikeRecord()
+        tokens_left = round(max(0, 128 - user.strikes), 2)
+
         wants_html = "text/html" in accept or "mozilla" in ua
         wants_plain = "turbowarp" in ua or "scratch" in ua or "text/plain" in accept
 
-        if wants_plain or wants_html:
-            return (
-                f"{encoded}\n\n"
-                f"Tiles checked: {checked_tiles}\n"
-                f"Radius used: {radius_miles} miles\n"
-                f"Tokens used: {token_cost}\n"
-                f"Tokens left: {tokens_left}/128\n"
-                f"(1 token regenerates every ~15 minutes.)"
-            ), 200, {'Content-Type': 'text/plain; charset=utf-8'}
-
-        return jsonify({
-            "encoded": encoded,
-            "tiles_checked": checked_tiles,
-            "radius_used": radius_miles,
-            "tokens_used": token_cost,
-            "tokens_left": tokens_left,
-            "note": f"You have {tokens_left} tokens left."
-        })
+        with timed("respond"):
+            if wants_binary:
+                response = encoded, 200, {
+                    "Content-Type": "application/octet-stream",
+                    "X-Tiles-Checked": str(checked_tiles),
+                    "X-Radius-Used": str(radius_miles),
+                    "X-Tokens-Used": str(token_cost),
+                    "X-Tokens-Left": str(tokens_left),
+                }
+            elif wants_plain or wants_html:
+                response = (
+                    f"{encoded}\n\n"
+                    f"Tiles checked: {checked_tiles}\n"
+                    f"Radius used: {radius_miles} miles\n"
+                    f"Tokens used: {token_cost}\n"
+                    f"Tokens left: {tokens_left}/128\n"
+                    f"(1 token regenerates every ~15 minutes.)"
+                ), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+            else:
+                response = jsonify({
+                    "encoded": encoded,
+                    "tiles_checked": checked_tiles,
+                    "radius_used": radius_miles,
+                    "tokens_used": token_cost,
+                    "tokens_left": tokens_left,
+                    "note": f"You have {tokens_left} tokens left."
+                })
+        observe_check(started, checked_tiles)
+        return response
 
     except Exception as e:
         add_strike(ip, 24)
-        decay_strikes(ip)
         return jsonify({
             "error": "P500",
             "message": f"Something went wrong: {str(e)}"
         }), 500
 
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format, for the admin IPs (whitelist the scraper)
+    ip = get_client_ip()
+    if ip not in WHITELISTED_IPS:
+        raise Forced404
+    return metrics_text(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
     
 #######################################################################################################################################################
 #######################################################################################################################################################
@@ -649,6 +1474,32 @@ def handle_forced_404(e):
 
 migrate_appeals()
 
+def start_server():
+    # Startup work for a serving process: preloading the polygons, the strike
+    # flusher and its signal handlers, and the idle sweeper. Called from __main__
+    # below and from wsgi.py, never on import, so tools and tests that import
+    # this module don't touch the live strike files in the background.
+    global write_behind
+
+    # With every level rasterized and the raster lookup as default, the GeoJSON is
+    # only parsed if a request actually asks for lookup=polygons
+    if WATER_LOOKUP != "raster" or len(water_rasters) < len(FOCUS_STEP_MAP):
+        load_water_polygons()
+
+    if STRIKE_FLUSH_MS > 0 and not strike_store.shared:
+        write_behind = True
+        threading.Thread(target=bannage_flusher, name="bannage-flusher", daemon=True).start()
+        atexit.register(flush_bannage)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            try:
+                previous_signal_handlers[signum] = signal.signal(signum, flush_on_signal)
+            except ValueError:
+                pass  # not the main thread, atexit still covers a normal exit
+
+    if STRIKE_SWEEP_SECONDS > 0:
+        threading.Thread(target=idle_sweeper, name="idle-sweeper", daemon=True).start()
+
 if __name__ == "__main__":
+    start_server()
     print("Starting Flask on 0.0.0.0:21095")
     app.run(host="0.0.0.0", port=21095, debug=False, use_reloader=False)
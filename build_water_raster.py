@@ -0,0 +1,53 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from watermap import FOCUS_STEP_MAP, WATER_RASTER_DIR, raster_lattice_shape, raster_path, water_grid
+
+# Offline builder for the /check raster lookup. For every focus level it samples
+# the water polygons on a global lattice (lat = -90 + row * step,
+# lon = -180 + col * step) with the same exact test /check uses, and saves it
+# bit-packed along each row as the flat file water_raster/level<N>.bin, which the
+# server memory-maps.
+#
+# The fine levels are big (level 5 is ~54.5k x 109k nodes, ~740 MB packed) and
+# take a long time to build, so levels can be picked with --levels.
+
+POINTS_PER_BAND = 2_000_000
+
+
+def build_level(focus_level):
+    step = FOCUS_STEP_MAP[focus_level]
+    rows, cols = raster_lattice_shape(step)
+    lons = -180 + np.arange(cols) * step
+    band_rows = max(1, POINTS_PER_BAND // cols)
+
+    out_path = raster_path(focus_level)
+    tmp_path = out_path + ".tmp"
+    packed = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(rows, (cols + 7) // 8))
+
+    started = time.time()
+    for row in range(0, rows, band_rows):
+        band = np.arange(row, min(row + band_rows, rows))
+        lats = -90 + band * step
+        water = water_grid(lats, lons)
+        packed[band[0]:band[-1] + 1] = np.packbits(water, axis=1)
+        print(f"level {focus_level}: {band[-1] + 1}/{rows} rows ({time.time() - started:.0f}s)", end="\r")
+
+    packed.flush()
+    del packed
+    os.replace(tmp_path, out_path)
+    print(f"\nlevel {focus_level}: wrote {out_path} ({rows}x{cols}, step {step})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rasterize the water polygons for each /check focus level.")
+    parser.add_argument("--levels", type=int, nargs="+", default=sorted(FOCUS_STEP_MAP),
+                        help="focus levels to build (default: all)")
+    args = parser.parse_args()
+
+    os.makedirs(WATER_RASTER_DIR, exist_ok=True)
+    for level in args.levels:
+        build_level(level)
@@ -0,0 +1,89 @@
+import struct
+
+import numpy as np
+
+# Encoders for /check grids: the dot-joined run-length text and the binary body.
+
+HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+def bit_runs(bits):
+    # (values, lengths) of the runs of equal bits in a flat bool array
+    change = np.flatnonzero(bits[1:] != bits[:-1]) + 1
+    bounds = np.concatenate(([0], change, [len(bits)]))
+    return bits[bounds[:-1]], np.diff(bounds)
+
+def split_runs(values, lengths):
+    # Runs longer than 0xFFFF become full 0xFFFF chunks followed by the remainder
+    chunks = (lengths + 0xFFFE) // 0xFFFF
+    counts = np.full(int(chunks.sum()), 0xFFFF, dtype=np.int64)
+    counts[np.cumsum(chunks) - 1] = lengths - (chunks - 1) * 0xFFFF
+    return np.repeat(values, chunks), counts
+
+def format_runs(values, counts):
+    # "{bit}x{count:04X}" per run, dot-joined, written straight into a byte buffer
+    out = np.empty((len(counts), 7), dtype=np.uint8)
+    out[:, 0] = ord("0") + values
+    out[:, 1] = ord("x")
+    for i, shift in enumerate((12, 8, 4, 0)):
+        out[:, 2 + i] = HEX_DIGITS[(counts >> shift) & 0xF]
+    out[:, 6] = ord(".")
+    return out.tobytes()[:-1].decode("ascii")
+
+def encode_runs(bits):
+    bits = np.asarray(bits, dtype=bool).ravel()
+    if not bits.size:
+        return ""
+    return format_runs(*split_runs(*bit_runs(bits)))
+
+def stream_runs(bands):
+    # Same text as encode_runs over all the bands joined, yielded band by band.
+    # The last run of each band is held back in case the next band continues it.
+    carry_bit, carry_len = None, 0
+    separator = ""
+    for band in bands:
+        values, lengths = bit_runs(np.asarray(band, dtype=bool).ravel())
+        if carry_bit is not None:
+            if values[0] == carry_bit:
+                lengths[0] += carry_len
+            else:
+                values = np.concatenate(([carry_bit], values))
+                lengths = np.concatenate(([carry_len], lengths))
+        carry_bit, carry_len = values[-1], lengths[-1]
+        if len(values) > 1:
+            yield separator + format_runs(*split_runs(values[:-1], lengths[:-1]))
+            separator = "."
+    if carry_bit is not None:
+        yield separator + format_runs(*split_runs(np.array([carry_bit]), np.array([carry_len])))
+
+# Binary /check body: magic, rows, cols (little-endian uint32), payload kind
+# (GRID_BITS or GRID_RUNS), then the payload
+GRID_MAGIC = b"WGRD"
+GRID_BITS = 0  # row-major bitset, np.packbits order (MSB first), 1 = water
+GRID_RUNS = 1  # first bit as one byte, then every run length as an LEB128 varint
+
+def encode_varints(values):
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        sizes += values >= (np.uint64(1) << np.uint64(shift))
+    starts = np.cumsum(sizes) - sizes
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for k in range(int(sizes.max(initial=0))):
+        sel = sizes > k
+        byte = (values[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(sizes[sel] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[sel] + k] = byte
+    return out.tobytes()
+
+def encode_binary(water, encoding="auto"):
+    # encoding is "bits", "runs" or "auto" (whichever payload is smaller)
+    rows, cols = water.shape
+    bits = water.ravel()
+    payloads = {}
+    if encoding in ("auto", "bits"):
+        payloads[GRID_BITS] = np.packbits(bits).tobytes()
+    if encoding in ("auto", "runs"):
+        values, lengths = bit_runs(bits)
+        payloads[GRID_RUNS] = bytes([int(values[0])]) + encode_varints(lengths)
+    kind = min(payloads, key=lambda k: len(payloads[k]))
+    return struct.pack("<4sIIB", GRID_MAGIC, rows, cols, kind) + payloads[kind]
@@ -0,0 +1,70 @@
+import bisect
+
+# Per-IP strike state as held in memory. The stores in boogerfuckerv7.py load and
+# save these; bench_strikes.py measures them.
+
+class StrikeRecord:
+    # One IP's strike state. Slotted instead of a dict to keep the per-IP
+    # footprint down (bench_strikes.py measures it); to_json/from_json are the
+    # bannage.json layout. last_update is None for records that never had one.
+    __slots__ = ("strikes", "last_update", "cooldown_until")
+
+    def __init__(self, strikes=0, last_update=None, cooldown_until=0):
+        self.strikes = strikes
+        self.last_update = last_update
+        self.cooldown_until = cooldown_until
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get("strikes", 0), data.get("last_update"), data.get("cooldown_until", 0))
+
+    def to_json(self):
+        data = {"strikes": self.strikes}
+        if self.last_update is not None:
+            data["last_update"] = self.last_update
+        data["cooldown_until"] = self.cooldown_until
+        return data
+
+    def astuple(self):
+        return self.strikes, self.last_update, self.cooldown_until
+
+    def copy(self):
+        return StrikeRecord(*self.astuple())
+
+    def assign(self, other):
+        self.strikes, self.last_update, self.cooldown_until = other.astuple()
+
+    def __eq__(self, other):
+        return isinstance(other, StrikeRecord) and self.astuple() == other.astuple()
+
+    def __repr__(self):
+        return f"StrikeRecord{self.astuple()}"
+
+class StrikeTable(dict):
+    # ip -> StrikeRecord, plus every IP in sorted order (index) for the admin
+    # dashboard's prefix filter and paging. The table is only changed by item
+    # assignment, del and pop, and those keep the index in step.
+    def __init__(self, records=()):
+        super().__init__(records)
+        self.index = sorted(self)
+
+    def __setitem__(self, ip, record):
+        if ip not in self:
+            bisect.insort(self.index, ip)
+        super().__setitem__(ip, record)
+
+    def __delitem__(self, ip):
+        super().__delitem__(ip)
+        del self.index[bisect.bisect_left(self.index, ip)]
+
+    def pop(self, ip, *default):
+        if ip not in self:
+            return super().pop(ip, *default)
+        del self.index[bisect.bisect_left(self.index, ip)]
+        return super().pop(ip)
+
+    def prefix_range(self, prefix):
+        # Index positions lo:hi of the IPs starting with prefix
+        lo = bisect.bisect_left(self.index, prefix)
+        hi = bisect.bisect_left(self.index, prefix + "\U0010ffff", lo)
+        return lo, hi
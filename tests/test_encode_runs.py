@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from grid_encoding import encode_runs, stream_runs
+
+
+def old_encode_runs(bits):
+    # The original per-bit encoder from before the numpy rewrite, kept as the oracle
+    if not bits:
+        return ""
+
+    result = []
+    current_bit = bits[0]
+    count = 1
+
+    for b in bits[1:]:
+        if b == current_bit and count < 0xFFFF:
+            count += 1
+        else:
+            result.append(f"{int(current_bit)}x{count:04X}")
+            current_bit = b
+            count = 1
+
+    result.append(f"{int(current_bit)}x{count:04X}")
+    return '.'.join(result)
+
+
+def random_bits(rng, i):
+    size = int(rng.integers(0, 2000))
+    kind = i % 3
+    if kind == 0:
+        return (rng.random(size) < rng.random()).astype(int).tolist()
+    if kind == 1:
+        # A few long runs, some past the 0xFFFF split
+        return np.repeat(rng.integers(0, 2, 5), rng.integers(1, 70000, 5)).tolist()
+    return [bool(b) for b in rng.random(size) < 0.001]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_old_encoder_on_random_bits(seed):
+    rng = np.random.default_rng(seed)
+    for i in range(200):
+        bits = random_bits(rng, i)
+        assert encode_runs(bits) == old_encode_runs(bits)
+
+
+@pytest.mark.parametrize("bits", [
+    [],
+    [0],
+    [1],
+    [0, 1],
+    [1] * 0xFFFE,
+    [1] * 0xFFFF,
+    [1] * 0x10000,
+    [0] * 0x1FFFE,
+    [0] * 0x1FFFF,
+    [0] * 0x1FFFE + [1],
+    [1] + [0] * 0xFFFF + [1],
+    [1] + [0] * 0x10000,
+], ids=lambda bits: f"{len(bits)}-bits")
+def test_matches_old_encoder_at_run_limits(bits):
+    assert encode_runs(bits) == old_encode_runs(bits)
+
+
+def test_grid_is_encoded_row_major():
+    rng = np.random.default_rng(1)
+    grid = rng.random((37, 53)) < 0.5
+    assert encode_runs(grid) == old_encode_runs(grid.ravel().tolist())
+
+
+@pytest.mark.parametrize("band_rows", [1, 3, 64])
+def test_stream_runs_matches_encode_runs(band_rows):
+    rng = np.random.default_rng(band_rows)
+    grid = np.repeat(rng.random((20, 1)) < 0.5, 5000, axis=1)  # rows that are one long run
+    grid[::7] = rng.random((3, 5000)) < 0.5
+    bands = (grid[start:start + band_rows] for start in range(0, len(grid), band_rows))
+    assert "".join(stream_runs(bands)) == encode_runs(grid)
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from watermap import FOCUS_STEP_MAP, estimate_tile_count, fit_radius
+
+TILES_PER_TOKEN = 525
+
+
+def old_fit_radius(radius_miles, step, tokens_available, tiles_per_token, token_multiplier):
+    # The original loop from /check, stepping down 0.1 miles at a time, kept as
+    # the oracle
+    while radius_miles > 0.1:
+        tile_est = estimate_tile_count(radius_miles, step)
+        token_est = round((tile_est / tiles_per_token) * token_multiplier, 2)
+        if token_est <= tokens_available:
+            return radius_miles, tile_est, token_est
+        radius_miles = round(radius_miles - 0.1, 1)
+    return None
+
+
+def assert_same(radius_miles, focus_level, tokens_available):
+    step = FOCUS_STEP_MAP[focus_level]
+    token_multiplier = 1.0 + focus_level * 0.2
+    expected = old_fit_radius(radius_miles, step, tokens_available, TILES_PER_TOKEN, token_multiplier)
+    got = fit_radius(radius_miles, step, tokens_available, TILES_PER_TOKEN, token_multiplier)
+    # repr as well, so 5 and 5.0 (and the rounding of the radius) count as different
+    assert (got, repr(got)) == (expected, repr(expected)), (radius_miles, focus_level, tokens_available)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_old_loop_on_random_inputs(seed):
+    rng = random.Random(seed)
+    for _ in range(10000):
+        radius = rng.choice([
+            rng.uniform(-1, 70),  # off the 0.1-mile ladder
+            round(rng.uniform(0, 70), 1),
+            float(rng.randint(0, 64)),
+            rng.uniform(0, 0.3),
+        ])
+        tokens = rng.choice([
+            rng.uniform(-50, 384),
+            rng.uniform(0, 3),
+            384 - rng.uniform(0, 1000),
+            float(rng.randint(0, 400)),
+            2384.0,
+            0.0,
+        ])
+        assert_same(radius, rng.choice(list(FOCUS_STEP_MAP)), tokens)
+
+
+@pytest.mark.parametrize("radius", [
+    -5.0, -0.1, 0.0, 0.05, 0.1, 0.1000001, 0.11, 0.15, 0.2, 0.25, 1.0, 1.05, 9.99, 10.0, 20.04, 63.95, 64.0,
+    float("nan"),
+])
+@pytest.mark.parametrize("tokens", [-100.0, 0.0, 0.01, 1.0, 7.5, 128.0, 384.0, 2384.0, float("nan")])
+@pytest.mark.parametrize("focus_level", sorted(FOCUS_STEP_MAP))
+def test_matches_old_loop_on_edge_inputs(radius, tokens, focus_level):
+    assert_same(radius, focus_level, tokens)
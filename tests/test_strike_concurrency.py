@@ -0,0 +1,168 @@
+import importlib.util
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "boogerfuckerv7.py")
+THREADS = 8
+ROUNDS = 200
+HOT_IPS = [f"8.8.8.{i}" for i in range(4)]
+NEW_IPS = [f"10.0.{i // 256}.{i % 256}" for i in range(ROUNDS)]
+module_ids = itertools.count()
+
+
+def load_server():
+    # A fresh copy of the server module on the strike files in the current
+    # directory, as another worker process would load it
+    spec = importlib.util.spec_from_file_location(f"strike_server_{next(module_ids)}", SERVER_PATH)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+
+    # Give up the GIL between finding no record and storing a new one, so two
+    # threads creating the same IP actually overlap without the stripe lock
+    set_strike_record = server.set_strike_record
+
+    def slow_set_strike_record(ip, user):
+        time.sleep(0)
+        set_strike_record(ip, user)
+
+    server.set_strike_record = slow_set_strike_record
+    return server
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "whitelist.json").write_text("[]")
+    (tmp_path / "passwords.json").write_text('["pw"]')
+    (tmp_path / "bannage.json").write_text("{}")
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads often, so races show up
+    yield tmp_path
+    sys.setswitchinterval(old_interval)
+
+
+def close_store(server):
+    if hasattr(server.strike_store, "close"):
+        server.strike_store.close()
+    else:
+        server.strike_store.db.close()
+
+
+def hammer(servers, background):
+    # THREADS threads each add ROUNDS strikes spread over HOT_IPS and half a
+    # strike to each of NEW_IPS, which they all create at about the same time (so
+    # the table grows under the walks), while background() loops alongside;
+    # returns the errors any of them hit
+    errors = []
+    stop = threading.Event()
+
+    def worker(t):
+        server = servers[t % len(servers)]
+        try:
+            for i in range(ROUNDS):
+                server.add_strike(HOT_IPS[i % len(HOT_IPS)], 1)
+                server.add_strike(NEW_IPS[i], 0.5)
+        except Exception as e:
+            errors.append(repr(e))
+
+    def walker():
+        try:
+            while not stop.is_set():
+                background()
+        except Exception as e:
+            errors.append("background: " + repr(e))
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(THREADS)]
+    walkers = [threading.Thread(target=walker) for _ in range(2)]
+    for thread in workers + walkers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    stop.set()
+    for thread in walkers:
+        thread.join()
+    return errors
+
+
+def walk_table(server):
+    # A Python-level walk of the whole table under strike_table_lock, giving up
+    # the GIL at every record: without the lock, threads adding IPs change the
+    # dict size mid-walk or leave the sorted index out of step with it
+    with server.strike_table_lock:
+        for ip, data in server.ip_strikes.items():
+            time.sleep(0)
+        assert server.ip_strikes.index == sorted(server.ip_strikes)
+
+
+def assert_no_lost_updates(strikes):
+    # strikes: ip -> strikes after hammer()
+    assert sum(strikes[ip] for ip in HOT_IPS) == THREADS * ROUNDS
+    assert all(strikes[ip] == THREADS * 0.5 for ip in NEW_IPS)
+    assert len(strikes) == len(HOT_IPS) + len(NEW_IPS)
+
+
+def test_journal_store_loses_no_updates(workdir, monkeypatch):
+    monkeypatch.setenv("STRIKE_STORE", "journal")
+    server = load_server()
+    server.write_behind = True  # as start_server() would, with the flusher below
+
+    def background():
+        server.sweep_idle_ips()
+        server.strike_store.compact()
+        server.active_banlist()
+        server.strike_page(sort="strikes")
+        walk_table(server)
+        server.flush_bannage()
+
+    try:
+        errors = hammer([server], background)
+        server.flush_bannage()
+    finally:
+        close_store(server)
+    assert errors == []
+    assert server.ip_strikes.index == sorted(server.ip_strikes)
+    assert_no_lost_updates({ip: data.strikes for ip, data in server.ip_strikes.items()})
+
+    # The snapshot plus journal replays to the same table
+    replayed = server.JournalStrikeStore(server.BANNAGE_FILE, server.BANNAGE_JOURNAL)
+    records = replayed.load()
+    replayed.close()
+    assert records == server.ip_strikes
+
+
+def test_sqlite_store_loses_no_updates_across_workers(workdir, monkeypatch):
+    monkeypatch.setenv("STRIKE_STORE", "sqlite")
+    servers = [load_server(), load_server()]  # two workers sharing bannage.sqlite3
+
+    def background():
+        for server in servers:
+            server.sweep_idle_ips()
+            server.strike_store.refresh_all()
+            server.active_banlist()
+            server.strike_page(sort="strikes")
+            walk_table(server)
+
+    try:
+        errors = hammer(servers, background)
+    finally:
+        for server in servers:
+            close_store(server)
+    assert errors == []
+    for server in servers:
+        # refresh and refresh_all change these tables under the same lock
+        assert server.ip_strikes.index == sorted(server.ip_strikes)
+
+    db = sqlite3.connect(workdir / "bannage.sqlite3")
+    try:
+        strikes = dict(db.execute("SELECT ip, strikes FROM strikes").fetchall())
+        counted = db.execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()[0]
+    finally:
+        db.close()
+    assert_no_lost_updates(strikes)
+    assert counted == len(strikes)
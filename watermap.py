@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import resource
+import threading
+import time
+
+import numpy as np
+import shapely
+from shapely.geometry import shape, Point
+from shapely.strtree import STRtree
+
+# Water geometry shared by the server and the offline tools (build_water_raster.py,
+# bench_check.py): the focus levels, the polygon lookups, the precomputed rasters
+# and the /check grid sizing. Nothing here touches the strike store or Flask.
+
+# Map focus level to step size (degrees between grid samples)
+FOCUS_STEP_MAP = {
+    0: 0.025,
+    1: 0.016,
+    2: 0.010,
+    3: 0.007,
+    4: 0.0047,
+    5: 0.0033
+}
+
+# Precomputed land/water rasters, one per focus level (see build_water_raster.py).
+WATER_RASTER_DIR = os.environ.get("WATER_RASTER_DIR", "water_raster")
+
+def raster_path(focus_level):
+    return os.path.join(WATER_RASTER_DIR, f"level{focus_level}.bin")
+
+def raster_lattice_shape(step):
+    # Lattice nodes sit at lat = -90 + row * step, lon = -180 + col * step
+    return int(180 / step) + 1, int(360 / step) + 1
+
+def open_raster(focus_level, mode="r"):
+    # Flat file of rows packed 8 nodes per byte, no header (the shape follows from
+    # the step). Memory-mapped read-only, so every worker process shares the same
+    # page-cache pages instead of holding its own copy.
+    rows, cols = raster_lattice_shape(FOCUS_STEP_MAP[focus_level])
+    return np.memmap(raster_path(focus_level), dtype=np.uint8, mode=mode, shape=(rows, (cols + 7) // 8))
+
+water_rasters = {}
+for level in FOCUS_STEP_MAP:
+    if os.path.exists(raster_path(level)):
+        water_rasters[level] = open_raster(level)
+if water_rasters:
+    print(f"Mapped water rasters for focus levels {sorted(water_rasters)}")
+
+# Set PREPARE_WATER=0 to skip preparing the polygons (to compare memory/latency)
+PREPARE_WATER = os.environ.get("PREPARE_WATER", "1") != "0"
+
+water_shapes = None
+water_tree = None
+water_geoms = None
+water_load_lock = threading.Lock()
+
+def load_water_polygons():
+    global water_shapes, water_tree, water_geoms
+    if water_tree is not None:
+        return
+    with water_load_lock:
+        if water_tree is not None:
+            return
+
+        # Load simplified GeoJSON coastline map (water polygons)
+        load_started = time.time()
+        with open("10m-world-map-rounded-to-3.json", "r") as f:
+            geojson_data = json.load(f)
+            shapes = [shape(geom) for geom in geojson_data["geometries"]]
+
+        # Spatial index over the water polygons, so a point lookup only tests the few
+        # polygons whose bounding boxes contain it instead of every polygon on the map
+        tree = STRtree(shapes)
+
+        # Prepared polygons keep their edge index around between point tests
+        if PREPARE_WATER:
+            shapely.prepare(tree.geometries)
+
+        water_shapes, water_geoms, water_tree = shapes, tree.geometries, tree
+        print(f"Loaded {len(water_shapes)} water polygons in {time.time() - load_started:.2f}s "
+              f"(prepared={PREPARE_WATER}, maxrss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss} KiB)")
+
+def is_point_in_water(lat, lon):
+    load_water_polygons()
+    point = Point(lon, lat)
+    candidates = water_tree.query(point)
+    return bool(shapely.intersects(water_geoms[candidates], point).any())
+
+def points_in_water(lats, lons):
+    # Batch version of is_point_in_water: classifies a whole array of points in
+    # one tree query and returns a boolean array of the same shape
+    load_water_polygons()
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    points = shapely.points(lons.ravel(), lats.ravel())
+    # Bounding box candidates first, then the exact test against the
+    # (prepared) polygons, since the tree only prepares the query side
+    point_idx, shape_idx = water_tree.query(points)
+    hits = shapely.intersects(water_geoms[shape_idx], points[point_idx])
+    result = np.zeros(points.shape, dtype=bool)
+    result[point_idx[hits]] = True
+    return result.reshape(lats.shape)
+
+def grid_axes(lat, lon, step, lat_range, lon_range):
+    # Row latitudes and column longitudes of a /check grid, same values as
+    # lat + dy * step / lon + dx * step
+    dy = np.arange(-lat_range, lat_range + 1)
+    dx = np.arange(-lon_range, lon_range + 1)
+    return lat + dy * step, lon + dx * step
+
+# Blocks this small (in grid cells) are classified point by point
+QUADTREE_LEAF_CELLS = 256
+
+def water_grid(lats, lons):
+    # Classifies the grid lats x lons (both ascending) by recursive subdivision.
+    # A block whose bounding box is covered by a single water polygon is all
+    # water, one that touches no polygon is all land; only blocks crossing a
+    # coastline get split further, down to leaves that go through points_in_water.
+    load_water_polygons()
+    result = np.zeros((len(lats), len(lons)), dtype=bool)
+    leaf_rows = []
+    leaf_cols = []
+
+    blocks = [(0, len(lats), 0, len(lons))]
+    while blocks:
+        r0, r1, c0, c1 = blocks.pop()
+        height = r1 - r0
+        width = c1 - c0
+        if height * width <= QUADTREE_LEAF_CELLS or height < 2 or width < 2:
+            rows, cols = np.meshgrid(np.arange(r0, r1), np.arange(c0, c1), indexing="ij")
+            leaf_rows.append(rows.ravel())
+            leaf_cols.append(cols.ravel())
+            continue
+
+        block = shapely.box(lons[c0], lats[r0], lons[c1 - 1], lats[r1 - 1])
+        candidates = water_geoms[water_tree.query(block)]
+        if not shapely.intersects(candidates, block).any():
+            continue
+        if shapely.covers(candidates, block).any():
+            result[r0:r1, c0:c1] = True
+            continue
+
+        rm = r0 + height // 2
+        cm = c0 + width // 2
+        blocks.extend([(r0, rm, c0, cm), (r0, rm, cm, c1), (rm, r1, c0, cm), (rm, r1, cm, c1)])
+
+    if leaf_rows:
+        rows = np.concatenate(leaf_rows)
+        cols = np.concatenate(leaf_cols)
+        result[rows, cols] = points_in_water(lats[rows], lons[cols])
+    return result
+
+def raster_origin(focus_level, lat, lon):
+    # Nearest raster lattice node to (lat, lon). A /check grid uses the same step
+    # as the lattice, so the whole grid is one contiguous block of rows and
+    # columns around this node and can be answered by slicing.
+    # Each bit is the exact polygon test at a node at most step / 2 away in lat
+    # and in lon, so it can only differ from is_point_in_water for points within
+    # step * sqrt(2) / 2 degrees of a coastline (or on features thinner than a
+    # step).
+    step = FOCUS_STEP_MAP[focus_level]
+    return int(round((lat + 90) / step)), int(round((lon + 180) / step))
+
+def raster_block(focus_level, row0, col0, height, width):
+    # Raster rows row0.. and columns col0.. unpacked to bools. Anything off the
+    # lattice (past the poles / the antimeridian) is land, same as the polygon path.
+    packed = water_rasters[focus_level]
+    result = np.zeros((height, width), dtype=bool)
+
+    rows = slice(max(row0, 0), min(row0 + height, packed.shape[0]))
+    cols = slice(max(col0, 0), min(col0 + width, packed.shape[1] * 8))
+    if rows.start >= rows.stop or cols.start >= cols.stop:
+        return result
+
+    byte_start = cols.start // 8
+    byte_stop = (cols.stop + 7) // 8
+    bits = np.unpackbits(packed[rows, byte_start:byte_stop], axis=1)
+    offset = cols.start - byte_start * 8
+    result[rows.start - row0:rows.stop - row0, cols.start - col0:cols.stop - col0] = \
+        bits[:, offset:offset + cols.stop - cols.start].astype(bool)
+    return result
+
+def estimate_tile_count(radius_miles, step):
+    radius_deg = radius_miles / 69.0
+    lat_range = int(radius_deg / step)
+    lon_range = int(radius_deg / step)
+    return (2 * lat_range + 1) * (2 * lon_range + 1)
+
+def fit_radius(radius_miles, step, tokens_available, tiles_per_token, token_multiplier):
+    # Largest radius /check can afford, as (radius, tile_est, token_est), or None.
+    # Same answer as trying radius_miles and then stepping down 0.1 miles at a
+    # time (rounded to 0.1) while radius > 0.1, but computed directly: the tile
+    # count only depends on n = int(radius / 69 / step) and never decreases with
+    # the radius, so find the largest affordable n, then the largest radius on the
+    # 0.1-mile ladder that maps to it.
+    def token_est(n):
+        return round((((2 * n + 1) ** 2) / tiles_per_token) * token_multiplier, 2)
+
+    def half_width(radius):
+        return int(radius / 69.0 / step)
+
+    if not radius_miles > 0.1:
+        return None
+    tile_est = estimate_tile_count(radius_miles, step)
+    cost = round((tile_est / tiles_per_token) * token_multiplier, 2)
+    if cost <= tokens_available:
+        return radius_miles, tile_est, cost
+
+    if not token_est(0) <= tokens_available:  # also catches a NaN budget
+        return None
+    n = max(0, int((math.sqrt(tokens_available * tiles_per_token / token_multiplier) - 1) / 2))
+    while n > 0 and token_est(n) > tokens_available:
+        n -= 1
+    while token_est(n + 1) <= tokens_available:
+        n += 1
+
+    # After the first step the ladder is exactly m / 10 for whole m, down to m = 2
+    top = round(round(radius_miles - 0.1, 1) * 10)
+    m = min(top, int((n + 1) * step * 69.0 * 10) + 2)
+    while m >= 2 and half_width(m / 10) > n:
+        m -= 1
+    while m < top and half_width((m + 1) / 10) <= n:
+        m += 1
+    if m < 2:
+        return None
+    radius = m / 10
+    tile_est = estimate_tile_count(radius, step)
+    return radius, tile_est, round((tile_est / tiles_per_token) * token_multiplier, 2)
@@ -0,0 +1,5 @@
+# WSGI entry point (e.g. gunicorn wsgi:app). Importing boogerfuckerv7 only sets
+# up the app; start_server() starts the background workers for this process.
+from boogerfuckerv7 import app, start_server
+
+start_server()